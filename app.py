@@ -7,8 +7,8 @@ Full feature set:
 - 30-day training plan (Mon-Sat: 3 strength + 3 cardio)
 - Progression by % (configurable)
 - Persistent SQLite storage (users, plans, workouts, entries, measurements, steps, supplements, goals, integrations)
-- Timers: training, rest, cardio (multiple per user) via asyncio tasks
-- Weekly/monthly reports and graphs (matplotlib)
+- Timers: training, rest, cardio (multiple per user) persisted in SQLite, fired by one asyncio dispatcher
+- Weekly/monthly reports and graphs (matplotlib, loaded lazily; optional SVG export)
 - Supplements scheduling (pre/post workout reminders)
 - Freeze/Resume functionality
 - Mi Fitness integration hooks (third-party providers or manual export)
@@ -22,22 +22,33 @@ Notes for PythonAnywhere free plan:
 
 from __future__ import annotations
 import os
+import re
+import gzip
+import shutil
+import tempfile
 import sqlite3
 import logging
 import asyncio
-from datetime import datetime, date, timedelta
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from datetime import datetime, date, timedelta, timezone
 from typing import Optional, List, Tuple, Dict, Any
 from io import BytesIO
+from xml.sax.saxutils import escape
 
 # 3rd party
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import numpy as np
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
 
 # logging
 logging.basicConfig(level=logging.INFO)
@@ -143,16 +154,88 @@ CREATE TABLE IF NOT EXISTS integrations (
   config TEXT,
   PRIMARY KEY(user_id, provider)
 );
+CREATE TABLE IF NOT EXISTS timers (
+  user_id INTEGER,
+  name TEXT,
+  fire_at TEXT,
+  message TEXT,
+  PRIMARY KEY(user_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_timers_fire_at ON timers(fire_at);
+CREATE INDEX IF NOT EXISTS idx_workouts_user_date ON workouts(user_id, wdate);
+CREATE INDEX IF NOT EXISTS idx_entries_workout ON entries(workout_id);
 """
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    return conn
+# Applied once when the shared connection is opened
+PRAGMAS = r"""
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA mmap_size = 268435456;
+PRAGMA cache_size = -20000;
+PRAGMA foreign_keys = ON;
+"""
+
+# One connection for the whole process (autocommit mode); writes go through transaction()
+_CONN: Optional[sqlite3.Connection] = None
+_DB_LOCK = threading.RLock()
+
+def get_conn() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        with _DB_LOCK:
+            if _CONN is None:
+                conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+                conn.row_factory = sqlite3.Row
+                conn.executescript(PRAGMAS)
+                _CONN = conn
+    return _CONN
+
+@contextmanager
+def transaction(immediate: bool = False):
+    """Serialize writers on the shared connection and wrap them in BEGIN/COMMIT.
+
+    immediate=True takes the write lock up front (BEGIN IMMEDIATE) for read-then-write
+    sequences that may race with other processes.
+    """
+    c = get_conn()
+    with _DB_LOCK:
+        c.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield c
+            c.execute('COMMIT')
+        except BaseException:
+            if c.in_transaction:
+                c.execute('ROLLBACK')
+            raise
+
+# Handlers run every DB helper on this one thread so sqlite I/O never blocks the bot loop
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+async def run_db(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_DB_EXECUTOR, fn, *args)
 
 def init_db():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    with get_conn() as c:
+    with _DB_LOCK:
+        c = get_conn()
         c.executescript(SCHEMA)
+        mode = c.execute('SELECT * FROM pragma_journal_mode').fetchone()[0]
+        if mode.lower() != 'wal':
+            logger.warning('sqlite journal_mode is %s, expected wal', mode)
+
+def snapshot_db(dest_dir: str) -> str:
+    """Write a consistent, compacted copy of the DB into dest_dir and return its path."""
+    snapshot = os.path.join(dest_dir, 'fitness.db')
+    with _DB_LOCK:
+        get_conn().execute('VACUUM INTO ?', (snapshot,))
+    return snapshot
+
+def gzip_file(path: str) -> str:
+    gz_path = path + '.gz'
+    with open(path, 'rb') as src, gzip.open(gz_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst)
+    return gz_path
 
 # -------------------- Plan generation & progression --------------------
 STRENGTH_SPLITS = {
@@ -160,9 +243,25 @@ STRENGTH_SPLITS = {
     'B': [('Deadlift', 3, 5), ('Overhead Press', 3, 5), ('Lat Pulldown / Pull-ups', 3, 8), ('Hanging Knee Raise', 3, 12)],
     'C': [('Front Squat / Lunge', 3, 8), ('Incline Bench / DB Press', 3, 8), ('Seated Row', 3, 10), ('Back Extension', 3, 12)]
 }
+# exercise -> (init_stats column, weekly progression %) for every loaded lift in STRENGTH_SPLITS
+_EX_TO_STAT = {
+    'Squat': ('squat', 5.0),
+    'Deadlift': ('squat', 5.0),
+    'Front Squat / Lunge': ('squat', 5.0),
+    'Bench Press': ('bench', 2.5),
+    'Incline Bench / DB Press': ('bench', 2.5),
+    'Bent-over Row': ('row', 2.5),
+    'Seated Row': ('row', 2.5),
+}
 CARDIO_MENU = [('Easy Run / Jog', 60), ('Rowing Erg', 60), ('Cycling (Z2)', 75), ('HIIT Intervals', 30), ('Stair Climber', 60), ('Elliptical', 60)]
 
-def make_30day_plan(start: date) -> List[Tuple[date, str, str]]:
+@dataclass(frozen=True)
+class Plan:
+    days: Tuple[Tuple[date, str, str], ...]
+    by_date: Dict[date, Tuple[str, str]]
+
+@lru_cache(maxsize=512)
+def make_30day_plan(start: date) -> Plan:
     out = []
     cycle = ['A', 'B', 'C']
     si = 0
@@ -178,7 +277,7 @@ def make_30day_plan(start: date) -> List[Tuple[date, str, str]]:
             name, base = CARDIO_MENU[ci % len(CARDIO_MENU)]
             out.append((d, 'cardio', f'Cardio: {name}'))
             ci += 1
-    return out
+    return Plan(days=tuple(out), by_date={d: (wtype, name) for d, wtype, name in out})
 
 def progression(base: float, weeks: int, percent: float) -> float:
     return round(base * ((1 + percent / 100) ** weeks), 1)
@@ -201,106 +300,279 @@ def calc_deficit(tdee, deficit_percent=40):
     return cal_def, proteins, fats, carbs
 
 # -------------------- Basic DB helpers --------------------
+class _UserCache:
+    """Per-user LRU cache with a TTL, so writes made by other gunicorn workers show up eventually.
+
+    Callers only store real rows; a missing row is never cached.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[int, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, user_id: int) -> Any:
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.ttl:
+            del self._data[user_id]
+            return None
+        self._data.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user_id: int, value: Any):
+        self._data[user_id] = (time.monotonic(), value)
+        self._data.move_to_end(user_id)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, user_id: int):
+        self._data.pop(user_id, None)
+
 def ensure_user(user_id: int, username: Optional[str] = None):
-    with get_conn() as c:
+    with transaction() as c:
         c.execute('INSERT OR IGNORE INTO users(user_id, username) VALUES(?,?)', (user_id, username))
 
 def set_plan_start(user_id: int, start: date):
-    with get_conn() as c:
+    with transaction() as c:
         c.execute('INSERT OR REPLACE INTO plans(user_id, start_date) VALUES(?,?)', (user_id, start.isoformat()))
+    _PLAN_CACHE.pop(user_id)
 
 def get_plan_start(user_id: int) -> Optional[date]:
-    with get_conn() as c:
-        r = c.execute('SELECT start_date FROM plans WHERE user_id=?', (user_id,)).fetchone()
-        return date.fromisoformat(r[0]) if r else None
+    r = get_conn().execute('SELECT start_date FROM plans WHERE user_id=?', (user_id,)).fetchone()
+    return date.fromisoformat(r[0]) if r else None
+
+# user_id -> (start_date, plan); only users with a stored start date are cached
+_PLAN_CACHE = _UserCache()
+
+def get_user_plan(user_id: int) -> Tuple[date, Plan]:
+    cached = _PLAN_CACHE.get(user_id)
+    if cached:
+        return cached
+    start = get_plan_start(user_id)
+    if start is None:
+        today = date.today()
+        return today, make_30day_plan(today)
+    cached = (start, make_30day_plan(start))
+    _PLAN_CACHE.put(user_id, cached)
+    return cached
+
+# user_id -> init_stats row; same policy as _PLAN_CACHE (missing rows are not cached)
+_INIT_STATS_CACHE = _UserCache()
 
 def set_init_stats(user_id: int, weight, height, bench, squat, row, curl):
-    with get_conn() as c:
+    with transaction() as c:
         c.execute('INSERT OR REPLACE INTO init_stats(user_id, weight, height, bench, squat, row, curl) VALUES(?,?,?,?,?,?,?)',
                   (user_id, weight, height, bench, squat, row, curl))
+    _INIT_STATS_CACHE.pop(user_id)
+
+def get_init_stats(user_id: int) -> Optional[sqlite3.Row]:
+    cached = _INIT_STATS_CACHE.get(user_id)
+    if cached is not None:
+        return cached
+    r = get_conn().execute('SELECT weight,height,bench,squat,row,curl FROM init_stats WHERE user_id=?', (user_id,)).fetchone()
+    if r is not None:
+        _INIT_STATS_CACHE.put(user_id, r)
+    return r
+
+def get_frozen_until(user_id: int) -> Optional[str]:
+    r = get_conn().execute('SELECT frozen_until FROM users WHERE user_id=?', (user_id,)).fetchone()
+    return r[0] if r else None
+
+def set_frozen_until(user_id: int, until: Optional[str]):
+    with transaction() as c:
+        c.execute('INSERT INTO users(user_id,frozen_until) VALUES(?,?) '
+                  'ON CONFLICT(user_id) DO UPDATE SET frozen_until=excluded.frozen_until', (user_id, until))
+
+def add_goal(user_id: int, text: str, target_value: float, target_date: str):
+    with transaction() as c:
+        c.execute('INSERT INTO goals(user_id,goal_text,target_value,target_date,active) VALUES(?,?,?,?,1)',
+                  (user_id, text, target_value, target_date))
+
+# -------------------- Supplements --------------------
+def save_supplement(user_id: int, name: str, dose: str, before: int, after: int):
+    with transaction() as c:
+        c.execute('INSERT OR REPLACE INTO supplements(user_id,name,dose,when_before_min,when_after_min,enabled) VALUES(?,?,?,?,?,1)',
+                  (user_id, name, dose, before, after))
 
-def get_init_stats(user_id: int) -> Optional[dict]:
-    with get_conn() as c:
-        r = c.execute('SELECT weight,height,bench,squat,row,curl FROM init_stats WHERE user_id=?', (user_id,)).fetchone()
-        if not r: return None
-        return {'weight': r[0], 'height': r[1], 'bench': r[2], 'squat': r[3], 'row': r[4], 'curl': r[5]}
+def get_supplements(user_id: int, enabled_only: bool = False) -> List[sqlite3.Row]:
+    sql = 'SELECT name,dose,when_before_min,when_after_min,enabled FROM supplements WHERE user_id=?'
+    if enabled_only:
+        sql += ' AND enabled=1'
+    return get_conn().execute(sql, (user_id,)).fetchall()
 
 # -------------------- Measurements/steps --------------------
 def log_steps(user_id: int, steps: int, sdate: Optional[date] = None):
     sdate = (sdate or date.today()).isoformat()
-    with get_conn() as c:
+    with transaction() as c:
         c.execute('INSERT OR REPLACE INTO steps(user_id,sdate,steps) VALUES(?,?,?)', (user_id, sdate, steps))
 
+def log_steps_many(user_id: int, records: List[Tuple[date, int]]):
+    rows = [(user_id, d.isoformat(), steps) for d, steps in records]
+    with transaction() as c:
+        c.executemany('INSERT OR REPLACE INTO steps(user_id,sdate,steps) VALUES(?,?,?)', rows)
+
 def log_measurement(user_id: int, waist: float, hips: float, chest: float, butt: float, weight: float, mdate: Optional[date] = None):
     mdate = (mdate or date.today()).isoformat()
-    with get_conn() as c:
+    with transaction() as c:
         c.execute('INSERT OR REPLACE INTO measurements(user_id,mdate,waist,hips,chest,butt,weight) VALUES(?,?,?,?,?,?,?)',
                   (user_id, mdate, waist, hips, chest, butt, weight))
 
+PROGRESS_METRICS = ('weight', 'waist', 'hips', 'chest', 'butt', 'steps', 'calories')
+
+def get_series(user_id: int, metric: str, start: date) -> List[sqlite3.Row]:
+    c = get_conn()
+    if metric == 'steps':
+        sql = "SELECT sdate,steps FROM steps WHERE user_id=? AND sdate>=? ORDER BY sdate"
+    elif metric == 'calories':
+        sql = "SELECT w.wdate, COALESCE(SUM(e.calories), 0) FROM entries e JOIN workouts w ON e.workout_id=w.id WHERE w.user_id=? AND w.wdate>=? GROUP BY w.wdate ORDER BY w.wdate"
+    else:
+        sql = f"SELECT mdate,{metric} FROM measurements WHERE user_id=? AND mdate>=? AND {metric} IS NOT NULL ORDER BY mdate"
+    return c.execute(sql, (user_id, start.isoformat())).fetchall()
+
 # -------------------- Plotting --------------------
-def plot_series(dates: List[date], values: List[float], title: str, ylabel: str) -> BytesIO:
-    plt.figure(figsize=(8, 4))
-    plt.plot(dates, values, marker='o')
-    plt.title(title)
-    plt.xlabel('Date')
-    plt.ylabel(ylabel)
-    plt.grid(True)
-    plt.tight_layout()
+# Opt-in (/progress metric period svg) chart sent as a document; Telegram does not show SVG inline
+SVG_W, SVG_H, SVG_PAD = 800, 400, 50
+
+def plot_svg(dates: np.ndarray, values: np.ndarray, title: str, ylabel: str) -> BytesIO:
+    x = dates.astype('int64').astype(np.float64)
+    xmin, xmax = x.min(), x.max()
+    vmin, vmax = float(values.min()), float(values.max())
+    px = SVG_PAD + (x - xmin) / ((xmax - xmin) or 1) * (SVG_W - 2 * SVG_PAD)
+    py = SVG_H - SVG_PAD - (values - vmin) / ((vmax - vmin) or 1) * (SVG_H - 2 * SVG_PAD)
+    points = ' '.join(f'{a:.1f},{b:.1f}' for a, b in zip(px, py))
+    dots = ''.join(f'<circle cx="{a:.1f}" cy="{b:.1f}" r="3"/>' for a, b in zip(px, py))
+    bottom = SVG_H - SVG_PAD
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {SVG_W} {SVG_H}" width="{SVG_W}" height="{SVG_H}" '
+        f'font-family="sans-serif" font-size="12">'
+        f'<rect width="100%" height="100%" fill="white"/>'
+        f'<text x="{SVG_W // 2}" y="25" text-anchor="middle" font-size="16">{escape(title)}</text>'
+        f'<path d="M{SVG_PAD},{SVG_PAD}V{bottom}H{SVG_W - SVG_PAD}" fill="none" stroke="#888"/>'
+        f'<text x="{SVG_PAD - 5}" y="{SVG_PAD + 4}" text-anchor="end">{vmax:g}</text>'
+        f'<text x="{SVG_PAD - 5}" y="{bottom + 4}" text-anchor="end">{vmin:g}</text>'
+        f'<text x="15" y="{SVG_H // 2}" transform="rotate(-90 15 {SVG_H // 2})" text-anchor="middle">{escape(ylabel)}</text>'
+        f'<text x="{SVG_PAD}" y="{bottom + 20}">{dates[0]}</text>'
+        f'<text x="{SVG_W - SVG_PAD}" y="{bottom + 20}" text-anchor="end">{dates[-1]}</text>'
+        f'<polyline points="{points}" fill="none" stroke="#1f77b4" stroke-width="2"/>'
+        f'<g fill="#1f77b4">{dots}</g>'
+        '</svg>'
+    )
+    return BytesIO(svg.encode('utf-8'))
+
+# Default PNG charts; matplotlib is imported on first use and one pyplot-free Figure is reused
+_FIG = None
+_AX = None
+_PLOT_LOCK = threading.Lock()
+
+def plot_series(dates: np.ndarray, values: np.ndarray, title: str, ylabel: str) -> BytesIO:
+    global _FIG, _AX
     bio = BytesIO()
-    plt.savefig(bio, format='png')
-    plt.close()
+    with _PLOT_LOCK:
+        if _FIG is None:
+            from matplotlib.figure import Figure
+            _FIG = Figure(figsize=(8, 4))
+            _AX = _FIG.subplots()
+            _FIG.subplots_adjust(left=0.1, right=0.97, top=0.9, bottom=0.15)
+        _AX.clear()
+        _AX.plot(dates, values, marker='o')
+        _AX.set_title(title)
+        _AX.set_xlabel('Date')
+        _AX.set_ylabel(ylabel)
+        _AX.grid(True)
+        _FIG.savefig(bio, format='png', dpi=72)
     bio.seek(0)
     return bio
 
 # -------------------- Timers --------------------
-USER_TIMER_TASKS: Dict[int, Dict[str, asyncio.Task]] = {}
-
-async def _timer_sleep_and_notify(app: Application, user_id: int, timer_name: str, seconds: int, finish_message: str):
-    try:
-        await asyncio.sleep(seconds)
-        await app.bot.send_message(chat_id=user_id, text=finish_message)
-    except asyncio.CancelledError:
-        await app.bot.send_message(chat_id=user_id, text=f'Timer {timer_name} cancelled')
-
-def start_user_timer(app: Application, user_id: int, timer_name: str, seconds: int, finish_message: str) -> bool:
-    user_tasks = USER_TIMER_TASKS.setdefault(user_id, {})
-    if timer_name in user_tasks:
+# Timers live in the timers table; one dispatcher task sleeps until the earliest fire_at (UTC)
+# Created by timer_dispatcher so it belongs to the bot loop (on 3.9 an Event binds to the loop current at creation)
+_TIMER_WAKEUP: Optional[asyncio.Event] = None
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+def _insert_timer(user_id: int, timer_name: str, seconds: int, finish_message: str) -> bool:
+    fire_at = (_utcnow() + timedelta(seconds=seconds)).isoformat()
+    with transaction() as c:
+        cur = c.execute('INSERT OR IGNORE INTO timers(user_id,name,fire_at,message) VALUES(?,?,?,?)',
+                        (user_id, timer_name, fire_at, finish_message))
+    return cur.rowcount == 1
+
+async def start_user_timer(user_id: int, timer_name: str, seconds: int, finish_message: str) -> bool:
+    if not await run_db(_insert_timer, user_id, timer_name, seconds, finish_message):
         return False
-    task = asyncio.create_task(_timer_sleep_and_notify(app, user_id, timer_name, seconds, finish_message))
-    user_tasks[timer_name] = task
+    if _TIMER_WAKEUP is not None:
+        _TIMER_WAKEUP.set()
     return True
 
 def stop_user_timer(user_id: int, timer_name: Optional[str] = None) -> List[str]:
-    stopped = []
-    user_tasks = USER_TIMER_TASKS.get(user_id, {})
-    if timer_name:
-        t = user_tasks.pop(timer_name, None)
-        if t:
-            t.cancel()
-            stopped.append(timer_name)
-    else:
-        for k, t in list(user_tasks.items()):
-            t.cancel()
-            stopped.append(k)
-            user_tasks.pop(k, None)
-    return stopped
+    # single DELETE ... RETURNING: no read snapshot to go stale before the write under WAL
+    with transaction() as c:
+        if timer_name:
+            rows = c.execute('DELETE FROM timers WHERE user_id=? AND name=? RETURNING name', (user_id, timer_name)).fetchall()
+        else:
+            rows = c.execute('DELETE FROM timers WHERE user_id=? RETURNING name', (user_id,)).fetchall()
+    return [r[0] for r in rows]
+
+def _pop_due_timer() -> Tuple[Optional[tuple], Optional[float]]:
+    """Claim the earliest timer if it is due; otherwise return seconds until it is (None if no timers)."""
+    with transaction(immediate=True) as c:
+        row = c.execute('SELECT user_id,name,fire_at,message FROM timers ORDER BY fire_at LIMIT 1').fetchone()
+        if not row:
+            return None, None
+        delay = (datetime.fromisoformat(row[2]) - _utcnow()).total_seconds()
+        if delay > 0:
+            return None, delay
+        c.execute('DELETE FROM timers WHERE user_id=? AND name=?', (row[0], row[1]))
+    return row, None
+
+async def timer_dispatcher(app: Application):
+    global _TIMER_WAKEUP
+    _TIMER_WAKEUP = asyncio.Event()
+    while True:
+        # clear before polling so a timer added while we query is not missed
+        _TIMER_WAKEUP.clear()
+        try:
+            row, delay = await run_db(_pop_due_timer)
+        except Exception as e:
+            logger.exception('timer dispatcher failed: %s', e)
+            row, delay = None, 60
+        if row:
+            user_id, _, _, message = row
+            try:
+                await app.bot.send_message(chat_id=user_id, text=message)
+            except Exception as e:
+                logger.warning('timer notify fail for %s: %s', user_id, e)
+            continue
+        try:
+            await asyncio.wait_for(_TIMER_WAKEUP.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+def _log_dispatcher_exit(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.error('timer dispatcher stopped', exc_info=fut.exception())
 
 # -------------------- Mi Fitness integration (stubs) --------------------
 def save_integration(user_id: int, provider: str, api_key: str):
-    with get_conn() as c:
+    with transaction() as c:
         c.execute('INSERT OR REPLACE INTO integrations(user_id,provider,api_key) VALUES(?,?,?)', (user_id, provider, api_key))
 
-def fetch_mi_data(user_id: int) -> Optional[dict]:
-    with get_conn() as c:
-        row = c.execute('SELECT provider, api_key FROM integrations WHERE user_id=?', (user_id,)).fetchone()
-    if not row:
-        return None
-    provider, api_key = row
+# Keep-alive pool shared by all provider calls
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+def get_integration(user_id: int) -> Optional[sqlite3.Row]:
+    return get_conn().execute('SELECT provider, api_key FROM integrations WHERE user_id=?', (user_id,)).fetchone()
+
+def fetch_mi_data(provider: str, api_key: str) -> Optional[dict]:
     if provider == 'thryve':
         url = f'https://api.tryrook.io/user/data'
         headers = {'Authorization': f'Bearer {api_key}'}
         try:
-            r = requests.get(url, headers=headers, timeout=10)
+            r = _SESSION.get(url, headers=headers, timeout=10)
             if r.status_code == 200:
                 return r.json()
         except Exception as e:
@@ -308,100 +580,106 @@ def fetch_mi_data(user_id: int) -> Optional[dict]:
     return None
 
 # -------------------- Commands handlers --------------------
+_HELP_TEXT = (
+    'Команды:\n'
+    '/start — регистрация\n'
+    '/init weight=100 height=176 bench=80 squat=100 row=60 curl=50 — задать стартовые показатели\n'
+    '/today — план на сегодня\n'
+    '/plan — показать 30-дневный план\n'
+    '/setplan YYYY-MM-DD — установить старт плана\n'
+    '/log ... — лог тренировки\n'
+    '/measure waist hips chest butt weight — сохранить замеры (воскресенье в 09:00 напоминание)\n'
+    '/steps N — записать шаги\n'
+    '/progress metric period [svg] — график (metric: weight|waist|hips|chest|butt|steps|calories; period: week|month|all; svg — файлом)\n'
+    '/start_training — запустить таймер тренировки\n'
+    '/start_rest M — таймер отдыха M минут\n'
+    '/start_cardio M — таймер кардио M минут\n'
+    '/stop_timer [name] — остановить таймер\n'
+    '/freeze N — заморозить тренировки на N дней\n'
+    '/resume — снять заморозку\n'
+    '/supp_add name=dose before=mins after=mins — добавить добавку\n'
+    '/supps — список добавок\n'
+    '/supp_recommend — рекомендации по добавкам\n'
+    '/mi_connect provider api_key — подключить Mi integration (thryve/rook)\n'
+    '/mi_sync — попытаться синхронизировать данные от провайдера\n'
+    '/set_goal text|target|YYYY-MM-DD — задать цель\n'
+    '/sleep H — записать часы сна\n'
+    '/cheatmeal — отметить читмил (см. неделю)\n'
+    '/export_db — скачать базу (владельцу)\n'
+)
+
+_SUPP_RECOMMEND_TEXT = ('Рекомендации по добавкам:\n'
+                        '- Креатин моногидрат 5г/день (постоянно)\n'
+                        '- Кофеин 200 мг за 30–45 мин до тренировки (по переносимости)\n'
+                        '- Бета-аланин 3–6 г/день (накопительно)\n'
+                        '- Цитруллин 6 г перед тренировкой (опционально)\n'
+                        '- Омега-3 1–3 г/день\n'
+                        '- Протеин 20–40 г после тренировки\n')
+
+# Whole-token key=value pairs; _KV_NUM matches decimal/exponent forms float() accepts (80., .5, +100, 1e2)
+_KV = re.compile(r'(?<!\S)([^\s=]+)=(\S*)')
+_KV_NUM = re.compile(r'(?<!\S)(\w+)=([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?!\S)')
+
+def _parse_kv(args: List[str]) -> Dict[str, str]:
+    return dict(_KV.findall(' '.join(args)))
+
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    ensure_user(user.id, user.username)
-    if not get_plan_start(user.id):
-        set_plan_start(user.id, date.today())
+    await run_db(ensure_user, user.id, user.username)
+    if not await run_db(get_plan_start, user.id):
+        await run_db(set_plan_start, user.id, date.today())
     await update.message.reply_text('Привет! Я Fitness Assistant. Введи /help чтобы увидеть команды')
 
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    txt = (
-        'Команды:\n'
-        '/start — регистрация\n'
-        '/init weight=100 height=176 bench=80 squat=100 row=60 curl=50 — задать стартовые показатели\n'
-        '/today — план на сегодня\n'
-        '/plan — показать 30-дневный план\n'
-        '/setplan YYYY-MM-DD — установить старт плана\n'
-        '/log ... — лог тренировки\n'
-        '/measure waist hips chest butt weight — сохранить замеры (воскресенье в 09:00 напоминание)\n'
-        '/steps N — записать шаги\n'
-        '/progress metric period — график (metric: weight|waist|hips|chest|butt|steps|calories; period: week|month|all)\n'
-        '/start_training — запустить таймер тренировки\n'
-        '/start_rest M — таймер отдыха M минут\n'
-        '/start_cardio M — таймер кардио M минут\n'
-        '/stop_timer [name] — остановить таймер\n'
-        '/freeze N — заморозить тренировки на N дней\n'
-        '/resume — снять заморозку\n'
-        '/supp_add name=dose before=mins after=mins — добавить добавку\n'
-        '/supps — список добавок\n'
-        '/supp_recommend — рекомендации по добавкам\n'
-        '/mi_connect provider api_key — подключить Mi integration (thryve/rook)\n'
-        '/mi_sync — попытаться синхронизировать данные от провайдера\n'
-        '/set_goal text|target|YYYY-MM-DD — задать цель\n'
-        '/sleep H — записать часы сна\n'
-        '/cheatmeal — отметить читмил (см. неделю)\n'
-        '/export_db — скачать базу (владельцу)\n'
-    )
-    await update.message.reply_text(txt)
+    await update.message.reply_text(_HELP_TEXT)
 
 async def cmd_init(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if not context.args:
         return await update.message.reply_text('Формат: /init weight=100 height=176 bench=80 squat=100 row=60 curl=50')
-    args = {}
-    for tok in context.args:
-        if '=' in tok:
-            k, v = tok.split('=', 1)
-            try: args[k] = float(v)
-            except: pass
-    set_init_stats(user.id, args.get('weight', 0), args.get('height', 0), args.get('bench', 0), args.get('squat', 0), args.get('row', 0), args.get('curl', 0))
+    args = {m.group(1): float(m.group(2)) for m in _KV_NUM.finditer(' '.join(context.args))}
+    await run_db(set_init_stats, user.id, args.get('weight', 0), args.get('height', 0), args.get('bench', 0), args.get('squat', 0), args.get('row', 0), args.get('curl', 0))
     await update.message.reply_text('Стартовые показатели сохранены')
 
 async def cmd_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    pl = make_30day_plan(get_plan_start(user.id) or date.today())
-    lines = [f'{d.isoformat()} ({d.strftime("%a")}): {name}' for d, _, name in pl]
+    _, pl = await run_db(get_user_plan, user.id)
+    lines = [f'{d.isoformat()} ({d.strftime("%a")}): {name}' for d, _, name in pl.days]
     await update.message.reply_text('\n'.join(lines))
 
 async def cmd_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if get_conn():
-        with get_conn() as c:
-            fr = c.execute('SELECT frozen_until FROM users WHERE user_id=?', (user.id,)).fetchone()
-            if fr and fr[0]:
-                try:
-                    until = date.fromisoformat(fr[0])
-                    if date.today() <= until:
-                        return await update.message.reply_text(f'Тренировки заморожены до {until}')
-                except Exception:
-                    pass
-    pl = make_30day_plan(get_plan_start(user.id) or date.today())
+    frozen_until = await run_db(get_frozen_until, user.id)
+    if frozen_until:
+        try:
+            until = date.fromisoformat(frozen_until)
+            if date.today() <= until:
+                return await update.message.reply_text(f'Тренировки заморожены до {until}')
+        except Exception:
+            pass
+    start, pl = await run_db(get_user_plan, user.id)
     today = date.today()
-    for d, wtype, name in pl:
-        if d == today:
-            stats = get_init_stats(user.id)
-            weeks = (d - (get_plan_start(user.id) or date.today())).days // 7
-            lines = [f"Сегодня ({d.isoformat()}): {name}"]
-            if wtype == 'strength':
-                split = name.split()[-1]
-                lines.append('Разминка: 10 мин кардио')
-                for ex, sets, reps in STRENGTH_SPLITS.get(split, []):
-                    w = None
-                    if stats:
-                        if 'Bench' in ex: w = progression(stats['bench'], weeks, 2.5)
-                        elif 'Squat' in ex or 'Deadlift' in ex: w = progression(stats['squat'], weeks, 5)
-                        elif 'Row' in ex: w = progression(stats['row'], weeks, 2.5)
-                        elif 'Curl' in ex or 'Biceps' in ex: w = progression(stats['curl'], weeks, 2.5)
-                    if ex == 'Plank': lines.append(f' • {ex} — {sets}×{reps} сек')
-                    else: lines.append(f' • {ex} — {sets}×{reps} {f"({w} кг)" if w else ""}')
-                lines.append('Финал: 10 мин кардио')
-            else:
-                base = next((b for n, b in CARDIO_MENU if name.endswith(n)), 60)
-                dur = int(round(base * (1 + 0.05 * weeks)))
-                lines.append(f' • {name.split(":", 1)[1].strip()} — {dur} минут')
-            return await update.message.reply_text('\n'.join(lines))
-    await update.message.reply_text('Сегодня отдых!')
+    entry = pl.by_date.get(today)
+    if not entry:
+        return await update.message.reply_text('Сегодня отдых!')
+    wtype, name = entry
+    stats = await run_db(get_init_stats, user.id)
+    weeks = (today - start).days // 7
+    lines = [f"Сегодня ({today.isoformat()}): {name}"]
+    if wtype == 'strength':
+        split = name.split()[-1]
+        lines.append('Разминка: 10 мин кардио')
+        for ex, sets, reps in STRENGTH_SPLITS.get(split, []):
+            m = _EX_TO_STAT.get(ex)
+            w = progression(stats[m[0]], weeks, m[1]) if stats and m else None
+            if ex == 'Plank': lines.append(f' • {ex} — {sets}×{reps} сек')
+            else: lines.append(f' • {ex} — {sets}×{reps} {f"({w} кг)" if w else ""}')
+        lines.append('Финал: 10 мин кардио')
+    else:
+        base = next((b for n, b in CARDIO_MENU if name.endswith(n)), 60)
+        dur = int(round(base * (1 + 0.05 * weeks)))
+        lines.append(f' • {name.split(":", 1)[1].strip()} — {dur} минут')
+    await update.message.reply_text('\n'.join(lines))
 
 async def cmd_measure(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -411,7 +689,7 @@ async def cmd_measure(update: Update, context: ContextTypes.DEFAULT_TYPE):
         weight, waist, chest, hips, butt = map(float, context.args)
     except:
         return await update.message.reply_text('Ошибка формата чисел')
-    log_measurement(user.id, waist, hips, chest, butt, weight)
+    await run_db(log_measurement, user.id, waist, hips, chest, butt, weight)
     await update.message.reply_text('Замеры сохранены ✅')
 
 async def cmd_steps(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -419,82 +697,71 @@ async def cmd_steps(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args: return await update.message.reply_text('Формат: /steps 10000')
     try: s = int(context.args[0])
     except: return await update.message.reply_text('Число?')
-    log_steps(user.id, s)
+    await run_db(log_steps, user.id, s)
     await update.message.reply_text('Шаги сохранены ✅')
 
 async def cmd_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if len(context.args) < 1:
-        return await update.message.reply_text('Формат: /progress metric period (metric: weight|waist|hips|chest|butt|steps|calories; period: week|month|all)')
+        return await update.message.reply_text('Формат: /progress metric period [svg] (metric: weight|waist|hips|chest|butt|steps|calories; period: week|month|all)')
     metric = context.args[0]
     period = context.args[1] if len(context.args) > 1 else 'week'
     end = date.today()
     start = {'week': end - timedelta(days=7), 'month': end - timedelta(days=30), 'all': date(1970, 1, 1)}.get(period, end - timedelta(days=7))
-    dates = []; values = []
-    with get_conn() as c:
-        if metric in ('weight', 'waist', 'hips', 'chest', 'butt'):
-            rows = c.execute(f"SELECT mdate,{metric} FROM measurements WHERE user_id=? AND mdate>=? ORDER BY mdate",
-                             (user.id, start.isoformat())).fetchall()
-            for r in rows: dates.append(date.fromisoformat(r[0])); values.append(r[1])
-        elif metric == 'steps':
-            rows = c.execute("SELECT sdate,steps FROM steps WHERE user_id=? AND sdate>=? ORDER BY sdate",
-                             (user.id, start.isoformat())).fetchall()
-            for r in rows: dates.append(date.fromisoformat(r[0])); values.append(r[1])
-        elif metric == 'calories':
-            rows = c.execute("SELECT w.wdate, SUM(e.calories) FROM entries e JOIN workouts w ON e.workout_id=w.id WHERE w.user_id=? AND w.wdate>=? GROUP BY w.wdate ORDER BY w.wdate",
-                             (user.id, start.isoformat())).fetchall()
-            for r in rows: dates.append(date.fromisoformat(r[0])); values.append(r[1] or 0)
-        else:
-            return await update.message.reply_text('Неизвестная метрика')
-    if not dates:
+    if metric not in PROGRESS_METRICS:
+        return await update.message.reply_text('Неизвестная метрика')
+    rows = await run_db(get_series, user.id, metric, start)
+    if not rows:
         return await update.message.reply_text('Нет данных за выбранный период')
-    bio = plot_series(dates, values, f'{metric} ({period})', metric)
+    dates = np.array([r[0] for r in rows], dtype='U10').astype('datetime64[D]')
+    values = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+    if len(context.args) > 2 and context.args[2] == 'svg':
+        bio = plot_svg(dates, values, f'{metric} ({period})', metric)
+        return await update.message.reply_document(document=bio, filename=f'{metric}_{period}.svg')
+    # first call imports matplotlib; render off the bot loop (_PLOT_LOCK serializes workers)
+    bio = await asyncio.to_thread(plot_series, dates, values, f'{metric} ({period})', metric)
     await update.message.reply_photo(photo=bio)
 
 async def cmd_start_training(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    pl = make_30day_plan(get_plan_start(user.id) or date.today())
+    _, pl = await run_db(get_user_plan, user.id)
     today = date.today()
-    wtype = None; name = None
-    for d, wt, n in pl:
-        if d == today: wtype = wt; name = n; break
+    wtype, name = pl.by_date.get(today, (None, None))
     if not wtype:
         return await update.message.reply_text('Сегодня отдых!')
     total_min = 60 if wtype == 'cardio' else 10 + 50 + 10
     seconds = total_min * 60
-    ok = start_user_timer(update.app, user.id, 'training', seconds, 'Тренировка завершена! Сделай 10 минут кардио.')
+    ok = await start_user_timer(user.id, 'training', seconds, 'Тренировка завершена! Сделай 10 минут кардио.')
     if not ok: return await update.message.reply_text('Таймер уже запущен')
-    with get_conn() as c:
-        rows = c.execute('SELECT name,dose,when_before_min,when_after_min,enabled FROM supplements WHERE user_id=? AND enabled=1',
-                         (user.id,)).fetchall()
+    rows = await run_db(get_supplements, user.id, True)
     for name, dose, before, after, enabled in rows:
         if before and before > 0:
-            start_user_timer(update.app, user.id, f'supp_pre_{name}', max(1, (before * 60)),
-                             f'Напоминание: {name} — {dose} (за {before} минут до тренировки)')
+            await start_user_timer(user.id, f'supp_pre_{name}', max(1, (before * 60)),
+                                   f'Напоминание: {name} — {dose} (за {before} минут до тренировки)')
     for name, dose, before, after, enabled in rows:
         if after and after > 0:
-            start_user_timer(update.app, user.id, f'supp_post_{name}', max(1, (after * 60)),
-                             f'Напоминание после тренировки: {name} — {dose}')
+            await start_user_timer(user.id, f'supp_post_{name}', max(1, (after * 60)),
+                                   f'Напоминание после тренировки: {name} — {dose}')
     await update.message.reply_text(f'Таймер тренировки запущен на {total_min} минут')
 
 async def cmd_rest(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     mins = int(context.args[0]) if context.args else 90
-    ok = start_user_timer(update.app, user.id, 'rest', mins * 60, 'Отдых окончен, начинаем следующий подход!')
+    ok = await start_user_timer(user.id, 'rest', mins * 60, 'Отдых окончен, начинаем следующий подход!')
     if not ok: return await update.message.reply_text('Таймер отдыха уже запущен')
     await update.message.reply_text(f'Таймер отдыха на {mins} мин запущен')
 
 async def cmd_cardio_timer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     mins = int(context.args[0]) if context.args else 10
-    ok = start_user_timer(update.app, user.id, 'cardio_block', mins * 60, 'Кардио блок завершён!')
+    ok = await start_user_timer(user.id, 'cardio_block', mins * 60, 'Кардио блок завершён!')
     if not ok: return await update.message.reply_text('Таймер кардио уже запущен')
     await update.message.reply_text(f'Кардио таймер на {mins} минут запущен')
 
 async def cmd_stop_timer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     name = context.args[0] if context.args else None
-    stopped = stop_user_timer(user.id, name)
+    stopped = await run_db(stop_user_timer, user.id, name)
     if not stopped: return await update.message.reply_text('Нет активных таймеров')
     await update.message.reply_text('Остановлены: ' + ','.join(stopped))
 
@@ -504,70 +771,60 @@ async def cmd_freeze(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try: days = int(context.args[0])
     except: return await update.message.reply_text('Число дней?')
     until = (date.today() + timedelta(days=days)).isoformat()
-    with get_conn() as c: c.execute('INSERT OR REPLACE INTO users(user_id,frozen_until) VALUES(?,?)', (user.id, until))
-    start_user_timer(update.app, user.id, 'freeze_return', days * 24 * 3600, 'Пауза окончена — время вернуться к тренировкам!')
+    await run_db(set_frozen_until, user.id, until)
+    await start_user_timer(user.id, 'freeze_return', days * 24 * 3600, 'Пауза окончена — время вернуться к тренировкам!')
     await update.message.reply_text(f'Заморожено до {until}')
 
 async def cmd_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    with get_conn() as c: c.execute('UPDATE users SET frozen_until=NULL WHERE user_id=?', (user.id,))
-    stopped = stop_user_timer(user.id, 'freeze_return')
+    await run_db(set_frozen_until, user.id, None)
+    await run_db(stop_user_timer, user.id, 'freeze_return')
     await update.message.reply_text('Заморозка снята')
 
 async def cmd_supp_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    params = {}
-    for tok in context.args:
-        if '=' in tok:
-            k, v = tok.split('=', 1); params[k] = v
+    params = _parse_kv(context.args)
     name = params.get('name') or params.get('0')
     if not name: return await update.message.reply_text('Укажи name=...')
     dose = params.get('dose', '')
     before = int(params.get('before', '0'))
     after = int(params.get('after', '0'))
-    with get_conn() as c:
-        c.execute('INSERT OR REPLACE INTO supplements(user_id,name,dose,when_before_min,when_after_min,enabled) VALUES(?,?,?,?,?,1)',
-                  (user.id, name, dose, before, after))
+    await run_db(save_supplement, user.id, name, dose, before, after)
     await update.message.reply_text('Добавка сохранена')
 
 async def cmd_supps(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    with get_conn() as c:
-        rows = c.execute('SELECT name,dose,when_before_min,when_after_min,enabled FROM supplements WHERE user_id=?',
-                         (user.id,)).fetchall()
+    rows = await run_db(get_supplements, user.id)
     if not rows: return await update.message.reply_text('Нет добавок')
     lines = []
     for r in rows: lines.append(f'{r[0]} — {r[1]} (before {r[2]}m after {r[3]}m) enabled={bool(r[4])}')
     await update.message.reply_text('\n'.join(lines))
 
 async def cmd_supp_recommend(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    txt = ('Рекомендации по добавкам:\n'
-           '- Креатин моногидрат 5г/день (постоянно)\n'
-           '- Кофеин 200 мг за 30–45 мин до тренировки (по переносимости)\n'
-           '- Бета-аланин 3–6 г/день (накопительно)\n'
-           '- Цитруллин 6 г перед тренировкой (опционально)\n'
-           '- Омега-3 1–3 г/день\n'
-           '- Протеин 20–40 г после тренировки\n')
-    await update.message.reply_text(txt)
+    await update.message.reply_text(_SUPP_RECOMMEND_TEXT)
 
 async def cmd_mi_connect(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if len(context.args) < 2:
         return await update.message.reply_text('Формат: /mi_connect provider api_key (provider: thryve|rook)')
     provider = context.args[0]; api_key = context.args[1]
-    save_integration(user.id, provider, api_key)
+    await run_db(save_integration, user.id, provider, api_key)
     await update.message.reply_text('Интеграция сохранена; используйте /mi_sync чтобы синхронизировать')
 
 async def cmd_mi_sync(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    data = fetch_mi_data(user.id)
+    integration = await run_db(get_integration, user.id)
+    data = await asyncio.to_thread(fetch_mi_data, *integration) if integration else None
     if not data: return await update.message.reply_text('Нет данных или ошибка интеграции')
     if 'steps' in data:
+        records = []
         for rec in data['steps']:
             try:
-                log_steps(user.id, int(rec.get('count', 0)), date.fromisoformat(rec.get('date')))
+                records.append((date.fromisoformat(rec.get('date')), int(rec.get('count', 0))))
             except Exception:
                 pass
+        if records:
+            await run_db(log_steps_many, user.id, records)
     await update.message.reply_text('Синхронизация завершена')
 
 async def cmd_set_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -577,9 +834,7 @@ async def cmd_set_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         raw = ' '.join(context.args)
         text, target, date_str = raw.split('|')
         target_val = float(target)
-        with get_conn() as c:
-            c.execute('INSERT INTO goals(user_id,goal_text,target_value,target_date,active) VALUES(?,?,?,?,1)',
-                      (user.id, text, target_val, date_str))
+        await run_db(add_goal, user.id, text, target_val, date_str)
         await update.message.reply_text('Цель сохранена')
     except Exception as e:
         await update.message.reply_text('Ошибка формата: ' + str(e))
@@ -601,7 +856,11 @@ async def cmd_export_db(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     # only allow owner to download? we'll allow anyone for now but better to restrict
     try:
-        await update.message.reply_document(open(DB_PATH, 'rb'))
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshot = await run_db(snapshot_db, tmp)
+            path = await asyncio.to_thread(gzip_file, snapshot)
+            with open(path, 'rb') as f:
+                await update.message.reply_document(document=f, filename='fitness.db.gz')
     except Exception as e:
         await update.message.reply_text(f'Ошибка при отправке БД: {e}')
 
@@ -638,6 +897,12 @@ application.add_handler(CommandHandler('export_db', cmd_export_db))
 # Initialize DB
 init_db()
 
+# One long-lived event loop for all updates, so timer tasks outlive the request that started them
+_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_LOOP.run_forever, name='bot-loop', daemon=True).start()
+asyncio.run_coroutine_threadsafe(application.initialize(), _LOOP).result()
+asyncio.run_coroutine_threadsafe(timer_dispatcher(application), _LOOP).add_done_callback(_log_dispatcher_exit)
+
 # Webhook route
 @flask_app.route('/' + TOKEN, methods=['POST'])
 def webhook():
@@ -645,7 +910,7 @@ def webhook():
     if update_json:
         try:
             update = Update.de_json(update_json, application.bot)
-            asyncio.run(application.process_update(update))
+            asyncio.run_coroutine_threadsafe(application.process_update(update), _LOOP).result()
         except Exception as e:
             logger.exception('failed processing update: %s', e)
             return jsonify(success=False, error=str(e))